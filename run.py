@@ -1,8 +1,16 @@
 import openpyxl
-import re
+from python_calamine import CalamineWorkbook, CalamineError
+try:
+    import re2 as re # Optional google-re2: linear-time matching, same compile/search API as re
+except ImportError:
+    import re
 from datetime import datetime
+from functools import lru_cache
 import os
+import io
+import zipfile
 import logging # Using logging for better feedback
+from concurrent.futures import ProcessPoolExecutor
 
 # --- Configuration ---
 INPUT_DIR = "input"
@@ -11,12 +19,43 @@ OUTPUT_FILLED = "output/output_filled.xlsx"
 START_ROW_TEMPLATE = 7  # Starting row in the output template
 DATA_BLOCK_START_ROW = 19 # First row of the data block in input files
 DATA_BLOCK_END_ROW = 1000   # Last row of the data block in input files
+EMPTY_STREAK_LIMIT = 20 # Stop scanning the data block after this many consecutive empty rows
+# Output template column index for each field of an extracted row tuple
+# (ETD, BA, ORDER_NO, REMARK, COLOR, SQNTY, PRICE, DETAIL) -> columns B, C, E, P, F, G, I, K
+OUTPUT_COLUMNS = (2, 3, 5, 16, 6, 7, 9, 11)
+MAX_WORKERS_LIMIT = 61 # ProcessPoolExecutor rejects more than 61 workers on Windows
+BLANK_SHEET_MAX_BYTES = 4096 # Worksheet XML parts smaller than this are checked for values before a full load
 
 # --- Setup Logging ---
 # Use INFO for general progress, WARNING for recoverable issues, ERROR for failures
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
+# --- Precompiled Patterns ---
+# ETD format: date (YYYY.MM.DD), optional trailing dot, then BA inside parentheses
+_ETD_RE = re.compile(r"(\d{4}\.\d{1,2}\.\d{1,2})\.?\s*\(([^)]+)\)")
+# Input filename prefix: ETD month/day (MM.DD) and BA, e.g. "ETD08.08 AIR JCON 선적서류 JB24FW-M34.xlsx"
+_FNAME_RE = re.compile(r"ETD(\d{2})\.(\d{2})\s+(AIR|TRUCK|BOAT|EXPRESS)")
+# Cell value element in worksheet XML: <v> (numbers, shared strings, cached results) or <is> (inline strings)
+_CELL_VALUE_RE = re.compile(rb"<(?:\w+:)?(?:v|is)>")
+
+# Exact types the reader yields for numeric cells (bool is deliberately not included)
+_NUMERIC = {int, float}
+
+# Month abbreviations for the DD-Mon output format (same as strftime's "%b" in the default C locale)
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
 # --- Helper Function ---
+@lru_cache(maxsize=256)
+def _parse_date(date_str_raw):
+    """
+    Converts a "YYYY.MM.DD" string to the DD-Mon output format. Raises ValueError on invalid dates.
+    Cached, since many input files share the same ETD date.
+    """
+    # Plain integer parsing and a table lookup instead of strptime/strftime (format parsing + locale lookup)
+    year, month, day = map(int, date_str_raw.split('.'))
+    datetime(year, month, day) # Validation only: raises ValueError for dates like 2024.02.30
+    return f"{day:02d}-{_MONTHS[month - 1]}"
+
 def prep_etd(data):
     """
     Parses the ETD string (e.g., "2024.08.08.(AIR)") to extract date and BA.
@@ -25,21 +64,16 @@ def prep_etd(data):
     if not isinstance(data, str):
         logging.warning(f"ETD 데이터가 문자열이 아님: {data}. 처리할 수 없음.")
         return None, None
-    # Regex to capture date (YYYY.MM.DD) and BA (inside parentheses)
-    # Allows potential trailing dot after date
-    match = re.search(r"([0-9]{4}\.[0-9]{1,2}\.[0-9]{1,2})\.?\s*\(([^)]+)\)", data)
+    # Single precompiled pattern; the optional trailing dot covers both ETD variants
+    match = _ETD_RE.search(data)
     if not match:
-        # Try alternative without trailing dot requirement for flexibility
-        match = re.search(r"([0-9]{4}\.[0-9]{1,2}\.[0-9]{1,2})\s*\(([^)]+)\)", data)
-        if not match:
-            logging.warning(f"ETD 데이터 형식 불일치: '{data}'. 날짜/BA 추출 불가.")
-            return None, None
+        logging.warning(f"ETD 데이터 형식 불일치: '{data}'. 날짜/BA 추출 불가.")
+        return None, None
     try:
         date_str_raw = match.group(1)
         ba_str = match.group(2)
         # Attempt to parse date, handle potential errors
-        date_obj = datetime.strptime(date_str_raw, "%Y.%m.%d")
-        date_str_formatted = date_obj.strftime("%d-%b")
+        date_str_formatted = _parse_date(date_str_raw)
         return date_str_formatted, ba_str
     except ValueError:
         logging.warning(f"ETD 날짜 형식 오류: '{date_str_raw}' in '{data}'. 날짜 변환 불가.")
@@ -49,207 +83,349 @@ def prep_etd(data):
         logging.error(f"prep_etd 처리 중 예외 발생 ('{data}'): {e}")
         return None, None
 
-# --- Main Processing Logic ---
-
-# Create output directory if it doesn't exist
-output_dir = os.path.dirname(OUTPUT_FILLED)
-if output_dir and not os.path.exists(output_dir):
+def prep_etd_from_filename(filename):
+    """
+    Extracts ETD and BA from the input filename prefix (e.g., "ETD08.08 AIR ...xlsx").
+    Returns formatted date (DD-Mon) and BA string, or None, None if the filename doesn't carry them.
+    """
+    match = _FNAME_RE.search(filename)
+    if not match:
+        return None, None
+    month, day, ba_str = match.groups()
     try:
-        os.makedirs(output_dir)
-        logging.info(f"'{output_dir}' 디렉토리를 생성했습니다.")
-    except OSError as e:
-        logging.error(f"출력 디렉토리 '{output_dir}' 생성 실패: {e}")
-        exit() # Cannot proceed without output directory
-
-# Load template workbook
-try:
-    template_wb = openpyxl.load_workbook(OUTPUT_TEMPLATE)
-    template_sheet = template_wb.active
-    logging.info(f"템플릿 파일 '{OUTPUT_TEMPLATE}' 로드 완료.")
-except FileNotFoundError:
-    logging.error(f"치명적 오류: 템플릿 파일 '{OUTPUT_TEMPLATE}'을 찾을 수 없습니다. 프로그램을 종료합니다.")
-    exit()
-except Exception as e:
-    logging.error(f"치명적 오류: 템플릿 파일 '{OUTPUT_TEMPLATE}' 로드 중 오류 발생: {e}")
-    exit()
-
-
-# Find input files (excluding temporary Excel files starting with ~)
-if not os.path.exists(INPUT_DIR):
-    logging.error(f"치명적 오류: 입력 디렉토리 '{INPUT_DIR}'을 찾을 수 없습니다. 프로그램을 종료합니다.")
-    exit()
-try:
-    # Ensure correct listing and filtering
-    all_files_in_dir = os.listdir(INPUT_DIR)
-    input_files = [
-        f for f in all_files_in_dir
-        if f.endswith('.xlsx')
-        and not f.startswith('~')
-        and os.path.isfile(os.path.join(INPUT_DIR, f)) # Make sure it's a file
-    ]
-    if not input_files:
-        logging.warning(f"입력 디렉토리 '{INPUT_DIR}'에서 처리할 .xlsx 파일을 찾을 수 없습니다.")
-        # No need to exit, just won't process anything
-    else:
-        logging.info(f"'{INPUT_DIR}' 디렉토리에서 {len(input_files)}개의 .xlsx 파일 발견.")
-
-except Exception as e:
-    logging.error(f"입력 디렉토리 '{INPUT_DIR}' 검색 중 오류 발생: {e}")
-    exit()
-
+        # The filename has no year; any leap year works since only DD-Mon is output (and 02.29 stays valid)
+        return _parse_date(f"2000.{month}.{day}"), ba_str
+    except ValueError:
+        return None, None # e.g. "ETD13.45", fall back to I11
 
-# --- Optional Test override ---
-# Uncomment the following lines to use a specific list for testing
-# test_files_list = [ 'ETD08.08 AIR JCON 선적서류 JB24FW-M34.xlsx', 'ETD08.08 TRUCK JCON 선적서류 JB24FW-M32.xlsx', 'ETD08.10 BOAT JCON 선적서류 JB24FW-M34.xlsx', 'ETD08.12 EXPRESS JCON 선적서류 JB24FW-M104-2.xlsx' ,'ETD08.15 AIR JCON 선적서류 JB24FW-M32.xlsx', 'ETD08.10 BOAT JCON 선적서류 JB24FW-M34.xlsx', 'ETD08.19 TRUCK JCON 선적서류 JB24FW-M36.xlsx', 'ETD08.21 TRUCK JCON 선적서류 JB24FW-M36.xlsx', 'ETD08.22 AIR JCON 선적서류 JB24FW-M35.xlsx', 'ETD08.22 BOAT JCON 선적서류 JB24FW-M36.xlsx']
-# input_files = [f for f in test_files_list if os.path.exists(os.path.join(INPUT_DIR, f))]
-# missing_test_files = set(test_files_list) - set(input_files)
-# if missing_test_files:
-#      logging.warning(f"테스트 파일 목록 중 다음 파일들을 찾을 수 없어 제외합니다: {', '.join(missing_test_files)}")
-# logging.info(f"테스트용 파일 목록 사용 (총 {len(input_files)}개): {input_files}")
-# --- End Test override ---
+def is_blank_workbook(source):
+    """
+    Cheap pre-check on the raw .xlsx archive (a path or binary file object), done before the
+    (much more expensive) full workbook parse.
+    Returns True only if every worksheet part is small and contains no cell values at all.
+    """
+    with zipfile.ZipFile(source) as archive:
+        sheet_parts = [info for info in archive.infolist()
+                       if info.filename.startswith("xl/worksheets/") and info.filename.endswith(".xml")]
+        if not sheet_parts:
+            return False # Unexpected layout, let the workbook parse decide
+        for info in sheet_parts:
+            if info.file_size >= BLANK_SHEET_MAX_BYTES:
+                return False # Large enough to hold real data, no need to look inside
+            if _CELL_VALUE_RE.search(archive.read(info)):
+                return False
+    return True
+
+def cell_value(values, row, column):
+    """
+    Returns the value at the 1-based (row, column) position of a sheet read with calamine's to_python(),
+    or None if the cell is empty ("" in calamine) or outside the used range.
+    """
+    if row <= len(values) and column <= len(values[row - 1]):
+        value = values[row - 1][column - 1]
+        if value != "":
+            return value
+    return None
+
+# --- Per-file Extraction ---
+class _LogCollector(logging.Handler):
+    """
+    Collects formatted log lines (level, text) instead of writing them out, so a worker's messages
+    can be replayed by the main process grouped per file instead of interleaving on stderr.
+    """
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter('%(message)s')) # Level prefix is added again on replay
+        self.lines = []
 
+    def emit(self, record):
+        self.lines.append((record.levelno, self.format(record)))
 
-current_output_row = START_ROW_TEMPLATE # Initialize the row counter for the output sheet
-processed_files_count = 0
+def extract(filepath):
+    """
+    Runs in a worker process. Returns (rows, log_lines): the valid data rows from extract_rows()
+    (None if the file could not be processed) and the messages logged while reading the file.
+    """
+    # A worker handles one file at a time, so swapping the root handlers here only captures this file
+    collector = _LogCollector()
+    root_logger = logging.getLogger()
+    saved_handlers = root_logger.handlers[:]
+    root_logger.handlers = [collector]
+    try:
+        rows = extract_rows(filepath)
+    finally:
+        root_logger.handlers = saved_handlers
+    return rows, collector.lines
 
-for filename in sorted(input_files):
+def extract_rows(filepath):
+    """
+    Reads a single input file and returns its valid data rows as tuples of
+    (ETD, BA, ORDER_NO, REMARK, COLOR, SQNTY, PRICE, DETAIL), or None if the file could not be processed.
+    Only reads the input and never touches the output template.
+    """
+    filename = os.path.basename(filepath)
     logging.info(f"--- 파일 처리 시작: {filename} ---")
-    filepath = os.path.join(INPUT_DIR, filename)
+    rows = [] # Valid data rows extracted from this file
     file_had_valid_data = False # Flag per file
 
     try:
-        # Load the input workbook, getting actual values (not formulas)
-        # Use read_only for potential speedup if not modifying input
-        workbook = openpyxl.load_workbook(filepath, data_only=True, read_only=True)
-        sheetnames = workbook.sheetnames
+        # Read the file once into an in-memory buffer, so the ZIP pre-check and the workbook parse
+        # both work from memory instead of issuing many small reads on the file.
+        # (An empty file just gives an empty buffer, which zipfile reports as BadZipFile below.)
+        with open(filepath, 'rb') as f:
+            buffer = io.BytesIO(f.read())
+
+        # Skip workbooks without any cell values before paying for the full workbook parse
+        if is_blank_workbook(buffer):
+            logging.warning(f"파일 '{filename}'의 시트에 값이 없습니다. 건너뜁니다.")
+            return rows
+
+        # Load the input workbook with calamine (Rust reader, no per-cell Python objects),
+        # getting actual values (cached formula results, not formulas)
+        buffer.seek(0) # The pre-check above leaves the buffer positioned at the end
+        workbook = CalamineWorkbook.from_filelike(buffer)
+        sheetnames = workbook.sheet_names
 
         if not sheetnames:
             logging.warning(f"파일 '{filename}'에 시트가 없습니다. 건너뜁니다.")
             workbook.close()
-            continue
+            return None
 
-        # Assume data is always on the *first* sheet
-        sheet = workbook[sheetnames[0]]
-        logging.info(f"'{filename}' 파일의 첫 번째 시트 ('{sheet.title}') 사용.")
+        # Assume data is always on the *first* sheet (by position, no name lookup needed)
+        sheet = workbook.get_sheet_by_index(0)
+        logging.info(f"'{filename}' 파일의 첫 번째 시트 ('{sheet.name}') 사용.")
+        # Cell values as flat row lists, anchored at A1 so the fixed cell positions below hold.
+        # Rows past the data block are never used, so they are not converted to Python objects at all.
+        values = sheet.to_python(skip_empty_area=False, nrows=DATA_BLOCK_END_ROW)
 
         # --- Extract common data (once per file) ---
-        # Assume the *last* sheet name is the ORDER_NO
-        ORDER_NO = sheetnames[-1] if sheetnames else None # Handle case with no sheets gracefully
-        if ORDER_NO is None:
-            logging.warning(f"파일 '{filename}'에서 ORDER_NO (마지막 시트 이름)를 추출할 수 없습니다. 건너뜁니다.")
-            workbook.close()
-            continue
+        # Assume the *last* sheet name is the ORDER_NO (sheetnames is non-empty, checked above)
+        ORDER_NO = sheetnames[-1]
 
-        etd_data = sheet["I11"].value
         # Assume REMARK is always in A22 for the entire file (as per original code before keyword search)
         # If you want the keyword search back, uncomment the relevant block from the previous version
-        REMARK = sheet["A22"].value
-
-        ETD, BA = None, None # Initialize ETD and BA
-        if etd_data is None:
-            logging.warning(f"  I11 셀이 비어 있음. ETD/BA 정보 없음.")
-        else:
-            ETD, BA = prep_etd(str(etd_data)) # Ensure input is string
-            # Log only if extraction failed or gave partial result
-            if ETD is None and BA is None:
-                 logging.warning(f"  ETD/BA ('{etd_data}') 처리 실패.")
-            elif ETD is None:
-                logging.warning(f"  ETD/BA ('{etd_data}') 처리: ETD 추출 실패, BA: {BA}")
-            elif BA is None:
-                 logging.warning(f"  ETD/BA ('{etd_data}') 처리: BA 추출 실패, ETD: {ETD}")
-            # No need to log success every time unless debugging
-            # else:
-            #     logging.info(f"  추출된 ETD: {ETD}, BA: {BA}")
+        REMARK = cell_value(values, 22, 1) # A22
+
+        # ETD/BA normally come from the filename prefix; I11 is only parsed as a fallback
+        ETD, BA = prep_etd_from_filename(filename)
+        if ETD is None:
+            etd_data = cell_value(values, 11, 9) # I11
+            if etd_data is None:
+                logging.warning(f"  I11 셀이 비어 있음. ETD/BA 정보 없음.")
+            else:
+                ETD, BA = prep_etd(str(etd_data)) # Ensure input is string
+                # Log only if extraction failed or gave partial result
+                if ETD is None and BA is None:
+                     logging.warning(f"  ETD/BA ('{etd_data}') 처리 실패.")
+                elif ETD is None:
+                    logging.warning(f"  ETD/BA ('{etd_data}') 처리: ETD 추출 실패, BA: {BA}")
+                elif BA is None:
+                     logging.warning(f"  ETD/BA ('{etd_data}') 처리: BA 추출 실패, ETD: {ETD}")
+                # No need to log success every time unless debugging
+                # else:
+                #     logging.info(f"  추출된 ETD: {ETD}, BA: {BA}")
 
 
         logging.info(f"  추출된 공통 데이터 - ORDER_NO: {ORDER_NO}, REMARK: {REMARK}")
 
-        # --- Loop through the potential data rows (19-28) in the input sheet ---
+        # --- Loop through the data block rows (DATA_BLOCK_START_ROW onwards, until a long empty run) ---
         data_found_in_block = False
-        for r in range(DATA_BLOCK_START_ROW, DATA_BLOCK_END_ROW + 1):
-            # Read data from the current row in the block
-            # Use .cell(row, column).value for potentially better robustness
-            DETAIL = sheet.cell(row=r, column=7).value # Column G
-            COLOR = sheet.cell(row=r, column=8).value # Column H
-            PRICE = sheet.cell(row=r, column=9).value # Column I
-            SQNTY = sheet.cell(row=r, column=10).value # Column J
+        empty_streak = 0 # Consecutive empty rows seen since the last data row
+        scan_end_row = DATA_BLOCK_END_ROW # Last row actually scanned (earlier if the scan stops early)
+        for r, row in enumerate(values[DATA_BLOCK_START_ROW - 1:DATA_BLOCK_END_ROW], start=DATA_BLOCK_START_ROW):
+            if len(row) < 10:
+                # Rows are only as wide as the used range; pad (only rows actually reached) so G-J exist
+                row = row + [""] * (10 - len(row))
+            # Columns G-J as-is; calamine's "" for empty cells already counts as empty in has_data
+            DETAIL, COLOR, PRICE, SQNTY = row[6:10]
 
             # --- Condition 1: Check if row has *any* meaningful data ---
             # Process only if at least one key cell has a value that's not just whitespace
-            has_data = any(val is not None and (not isinstance(val, str) or val.strip())
-                           for val in [DETAIL, COLOR, PRICE, SQNTY])
-
-            if has_data:
+            # (Spelled out per value so it short-circuits without building a list and generator per row)
+            has_data = ((DETAIL is not None and (not isinstance(DETAIL, str) or DETAIL.strip()))
+                        or (COLOR is not None and (not isinstance(COLOR, str) or COLOR.strip()))
+                        or (PRICE is not None and (not isinstance(PRICE, str) or PRICE.strip()))
+                        or (SQNTY is not None and (not isinstance(SQNTY, str) or SQNTY.strip())))
+
+            if not has_data:
+                # Data rows are contiguous, so a long empty run *after* data means the block has ended;
+                # stop here instead of scanning the remaining rows up to DATA_BLOCK_END_ROW.
+                # Empty rows before the first data row never stop the scan (the block may start late).
+                empty_streak += 1
+                if data_found_in_block and empty_streak > EMPTY_STREAK_LIMIT:
+                    scan_end_row = r
+                    break
+            else:
+                empty_streak = 0
                 data_found_in_block = True # Mark that we found *some* data in the block
+                # Map calamine's "" for empty cells to None, only for rows that are used or reported
+                if DETAIL == "": DETAIL = None
+                if COLOR == "": COLOR = None
+                if PRICE == "": PRICE = None
+                if SQNTY == "": SQNTY = None
 
                 # --- Condition 2: Validate data types for PRICE and SQNTY ---
-                # They must be numeric (int or float). None is not numeric.
-                price_is_numeric = isinstance(PRICE, (int, float))
-                sqnty_is_numeric = isinstance(SQNTY, (int, float))
+                # They must be numeric (int or float). None is not numeric, and neither is bool.
+                price_is_numeric = type(PRICE) in _NUMERIC
+                sqnty_is_numeric = type(SQNTY) in _NUMERIC
 
                 if price_is_numeric and sqnty_is_numeric:
-                    # --- Data is valid, write to output ---
+                    # --- Data is valid, collect it for the output ---
                     file_had_valid_data = True # Mark that this *file* contained valid data to write
-                    logging.info(f"    - 입력 행 {r}: 유효 데이터 발견. 출력 행 {current_output_row}에 쓰는 중...")
-
-                    template_sheet[f"B{current_output_row}"] = ETD
-                    template_sheet[f"C{current_output_row}"] = BA
-                    template_sheet[f"E{current_output_row}"] = ORDER_NO
-                    template_sheet[f"F{current_output_row}"] = COLOR
-                    template_sheet[f"G{current_output_row}"] = SQNTY
-                    template_sheet[f"I{current_output_row}"] = PRICE
-                    template_sheet[f"K{current_output_row}"] = DETAIL
-                    template_sheet[f"P{current_output_row}"] = REMARK # Use the common remark
-
-                    # --- Move to the next row in the output template ---
-                    current_output_row += 1
+                    # Lazy %-style args: the message is only formatted if INFO is actually emitted
+                    logging.info("    - 입력 행 %d: 유효 데이터 발견.", r)
+                    rows.append((ETD, BA, ORDER_NO, REMARK, COLOR, SQNTY, PRICE, DETAIL))
                 else:
                     # --- Data found, but invalid type, skip this row ---
-                    logging.warning(f"    - 입력 행 {r}: 건너뜀. PRICE ('{PRICE}', type: {type(PRICE).__name__}) "
-                                    f"또는 SQNTY ('{SQNTY}', type: {type(SQNTY).__name__})가 숫자가 아님.")
-            # else:
-                 # This row within the block was essentially empty or whitespace only
-                 # logging.debug(f"    - 입력 행 {r}: 데이터 없음. 건너뜀.") # Optional: for debugging empty rows
+                    logging.warning("    - 입력 행 %d: 건너뜀. PRICE ('%s', type: %s) 또는 SQNTY ('%s', type: %s)가 숫자가 아님.",
+                                    r, PRICE, type(PRICE).__name__, SQNTY, type(SQNTY).__name__)
 
         if not data_found_in_block:
-             logging.warning(f"  파일 '{filename}'의 {DATA_BLOCK_START_ROW}-{DATA_BLOCK_END_ROW} 행 범위에서 데이터를 찾지 못했습니다.")
+             logging.warning(f"  파일 '{filename}'의 {DATA_BLOCK_START_ROW}-{scan_end_row} 행 범위에서 데이터를 찾지 못했습니다.")
         elif not file_had_valid_data and data_found_in_block:
             # This case means we found rows with data, but none had valid numeric PRICE/SQNTY
-             logging.warning(f"  파일 '{filename}'의 {DATA_BLOCK_START_ROW}-{DATA_BLOCK_END_ROW} 행 범위에서 데이터는 찾았으나, 유효한 숫자 타입의 PRICE/SQNTY를 가진 행이 없었습니다.")
+             logging.warning(f"  파일 '{filename}'의 {DATA_BLOCK_START_ROW}-{scan_end_row} 행 범위에서 데이터는 찾았으나, 유효한 숫자 타입의 PRICE/SQNTY를 가진 행이 없었습니다.")
 
 
-        workbook.close() # Close the input workbook (important with read_only=True)
-        processed_files_count += 1
+        workbook.close() # Close the input workbook
+        return rows
 
     except FileNotFoundError:
         # This specific error is less likely here as we check existence before the loop, but keep for robustness
         logging.error(f"파일 '{filepath}'을(를) 처리 중 찾을 수 없습니다. 건너뜁니다.")
-        continue
-    except KeyError as e:
-        # Error accessing sheet name or potentially cell (less likely with .cell)
-        logging.error(f"파일 '{filename}' 처리 중 시트 이름 또는 셀 접근 오류 발생 ({e}). 건너뜁니다.")
-        if 'workbook' in locals() and workbook: workbook.close() # Try to close if open
-        continue
-    except zipfile.BadZipFile:
+        return None
+    except (zipfile.BadZipFile, CalamineError):
          logging.error(f"파일 '{filename}'이(가) 유효한 Excel 파일이 아니거나 손상되었습니다. 건너뜁니다.")
          if 'workbook' in locals() and workbook: workbook.close()
-         continue
+         return None
     except Exception as e:
         logging.error(f"파일 '{filename}' 처리 중 예기치 않은 오류 발생: {e}", exc_info=True) # Include traceback for debugging
         if 'workbook' in locals() and workbook: workbook.close() # Try to close if open
-        continue # Continue with the next file
+        return None # Continue with the next file
 
-# --- Final Save ---
-if current_output_row > START_ROW_TEMPLATE: # Only save if data was actually written
-    logging.info(f"총 {processed_files_count}개 파일 처리 완료. {current_output_row - START_ROW_TEMPLATE}개의 데이터 행을 출력 파일에 기록 중...")
+def read_order_key(filepath):
+    """
+    Sort key for the file read order: the file's inode number, or 0 if it can't be stat'ed
+    (e.g. removed after listing). extract() then reports that file; here it only loses its place in the order.
+    """
     try:
-        template_wb.save(OUTPUT_FILLED)
-        logging.info(f"✅ 모든 데이터 처리가 완료되어 '{OUTPUT_FILLED}'에 저장되었습니다.")
-    except PermissionError:
-         logging.error(f"치명적 오류: 파일 '{OUTPUT_FILLED}' 저장 권한이 없습니다. 파일이 다른 프로그램에서 열려있는지 확인하세요.")
+        return os.stat(filepath).st_ino
+    except OSError:
+        return 0
+
+# --- Main Processing Logic ---
+def main():
+    # Create output directory if it doesn't exist
+    output_dir = os.path.dirname(OUTPUT_FILLED)
+    if output_dir and not os.path.exists(output_dir):
+        try:
+            os.makedirs(output_dir)
+            logging.info(f"'{output_dir}' 디렉토리를 생성했습니다.")
+        except OSError as e:
+            logging.error(f"출력 디렉토리 '{output_dir}' 생성 실패: {e}")
+            exit() # Cannot proceed without output directory
+
+    # Load template workbook
+    try:
+        template_wb = openpyxl.load_workbook(OUTPUT_TEMPLATE)
+        template_sheet = template_wb.active
+        logging.info(f"템플릿 파일 '{OUTPUT_TEMPLATE}' 로드 완료.")
+    except FileNotFoundError:
+        logging.error(f"치명적 오류: 템플릿 파일 '{OUTPUT_TEMPLATE}'을 찾을 수 없습니다. 프로그램을 종료합니다.")
+        exit()
     except Exception as e:
-        logging.error(f"치명적 오류: 최종 파일 '{OUTPUT_FILLED}' 저장 중 오류 발생: {e}")
-elif processed_files_count > 0:
-    logging.warning(f"총 {processed_files_count}개 파일 처리 완료. 그러나 유효한 데이터 행이 없어 최종 출력 파일을 저장하지 않았습니다.")
-else:
-     logging.info("처리할 입력 파일이 없거나 모든 파일 처리 중 오류가 발생하여 최종 출력 파일을 저장하지 않았습니다.")
\ No newline at end of file
+        logging.error(f"치명적 오류: 템플릿 파일 '{OUTPUT_TEMPLATE}' 로드 중 오류 발생: {e}")
+        exit()
+
+
+    # Find input files (excluding temporary Excel files starting with ~)
+    if not os.path.exists(INPUT_DIR):
+        logging.error(f"치명적 오류: 입력 디렉토리 '{INPUT_DIR}'을 찾을 수 없습니다. 프로그램을 종료합니다.")
+        exit()
+    try:
+        # Ensure correct listing and filtering
+        all_files_in_dir = os.listdir(INPUT_DIR)
+        input_files = [
+            f for f in all_files_in_dir
+            if f.endswith('.xlsx')
+            and not f.startswith('~')
+            and os.path.isfile(os.path.join(INPUT_DIR, f)) # Make sure it's a file
+        ]
+        if not input_files:
+            logging.warning(f"입력 디렉토리 '{INPUT_DIR}'에서 처리할 .xlsx 파일을 찾을 수 없습니다.")
+            # No need to exit, just won't process anything
+        else:
+            logging.info(f"'{INPUT_DIR}' 디렉토리에서 {len(input_files)}개의 .xlsx 파일 발견.")
+
+    except Exception as e:
+        logging.error(f"입력 디렉토리 '{INPUT_DIR}' 검색 중 오류 발생: {e}")
+        exit()
+
+
+    # --- Optional Test override ---
+    # Uncomment the following lines to use a specific list for testing
+    # test_files_list = [ 'ETD08.08 AIR JCON 선적서류 JB24FW-M34.xlsx', 'ETD08.08 TRUCK JCON 선적서류 JB24FW-M32.xlsx', 'ETD08.10 BOAT JCON 선적서류 JB24FW-M34.xlsx', 'ETD08.12 EXPRESS JCON 선적서류 JB24FW-M104-2.xlsx' ,'ETD08.15 AIR JCON 선적서류 JB24FW-M32.xlsx', 'ETD08.10 BOAT JCON 선적서류 JB24FW-M34.xlsx', 'ETD08.19 TRUCK JCON 선적서류 JB24FW-M36.xlsx', 'ETD08.21 TRUCK JCON 선적서류 JB24FW-M36.xlsx', 'ETD08.22 AIR JCON 선적서류 JB24FW-M35.xlsx', 'ETD08.22 BOAT JCON 선적서류 JB24FW-M36.xlsx']
+    # input_files = [f for f in test_files_list if os.path.exists(os.path.join(INPUT_DIR, f))]
+    # missing_test_files = set(test_files_list) - set(input_files)
+    # if missing_test_files:
+    #      logging.warning(f"테스트 파일 목록 중 다음 파일들을 찾을 수 없어 제외합니다: {', '.join(missing_test_files)}")
+    # logging.info(f"테스트용 파일 목록 사용 (총 {len(input_files)}개): {input_files}")
+    # --- End Test override ---
+
+
+    pending_rows = [] # Rows from all files, written to the template in a single pass at the end
+    processed_files_count = 0
+    filepaths = [os.path.join(INPUT_DIR, filename) for filename in sorted(input_files)]
+
+    # Read files in inode order (roughly their on-disk order on ext4/xfs) for better readahead locality;
+    # the output still follows the sorted filename order below
+    read_order = sorted(filepaths, key=read_order_key)
+
+    # Input files are independent, so parse them in parallel worker processes.
+    # Only the extracted row tuples and each file's log lines come back.
+    results = {}
+    if read_order: # No pool (and no worker start-up) when there is nothing to read
+        # No more workers than files or CPUs, since the pool may start all of them up front
+        max_workers = min(len(read_order), os.cpu_count() or 1, MAX_WORKERS_LIMIT)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(read_order, executor.map(extract, read_order)))
+
+    for filepath in filepaths:
+        rows, log_lines = results[filepath]
+        # Replay the worker's messages here, so they stay grouped per file in filename order
+        for level, line in log_lines:
+            logging.log(level, line)
+        if rows is None:
+            continue # File could not be processed (error logged above)
+        processed_files_count += 1
+        if rows:
+            first_output_row = START_ROW_TEMPLATE + len(pending_rows)
+            last_output_row = first_output_row + len(rows) - 1
+            output_range = f"{first_output_row}" if len(rows) == 1 else f"{first_output_row}-{last_output_row}"
+            logging.info(f"  유효 데이터 {len(rows)}개 행 -> 출력 행 {output_range}에 기록 예정.")
+        pending_rows.extend(rows)
+
+    # --- Write all collected rows to the template ---
+    for output_row, row in enumerate(pending_rows, start=START_ROW_TEMPLATE):
+        # Address cells by (row, column) index; "B7"-style keys would be re-parsed on every write
+        for column, value in zip(OUTPUT_COLUMNS, row):
+            template_sheet.cell(row=output_row, column=column, value=value)
+
+    # --- Final Save ---
+    if pending_rows: # Only save if data was actually written
+        logging.info(f"총 {processed_files_count}개 파일 처리 완료. {len(pending_rows)}개의 데이터 행을 출력 파일에 기록 중...")
+        try:
+            template_wb.save(OUTPUT_FILLED)
+            logging.info(f"✅ 모든 데이터 처리가 완료되어 '{OUTPUT_FILLED}'에 저장되었습니다.")
+        except PermissionError:
+             logging.error(f"치명적 오류: 파일 '{OUTPUT_FILLED}' 저장 권한이 없습니다. 파일이 다른 프로그램에서 열려있는지 확인하세요.")
+        except Exception as e:
+            logging.error(f"치명적 오류: 최종 파일 '{OUTPUT_FILLED}' 저장 중 오류 발생: {e}")
+    elif processed_files_count > 0:
+        logging.warning(f"총 {processed_files_count}개 파일 처리 완료. 그러나 유효한 데이터 행이 없어 최종 출력 파일을 저장하지 않았습니다.")
+    else:
+         logging.info("처리할 입력 파일이 없거나 모든 파일 처리 중 오류가 발생하여 최종 출력 파일을 저장하지 않았습니다.")
+
+
+if __name__ == "__main__":
+    main()